@@ -36,14 +36,19 @@
 # Each input file is represented as one data object.
 # descriptive_data and xy_pairs are pandas DataFrames
 # filepath is the filepath in form ("ecostress_data_files\\datafile.txt")
+# meta is a dict mapping each descriptor to its value (first occurrence, whitespace stripped)
+
+import os.path
+
 
 # linked to functional requirement 3 - preprocessing of data files into data objects
 class DataObject:
-    def __init__(self, descriptive_data, xy_pairs, filepath):
+    def __init__(self, descriptive_data, xy_pairs, filepath, meta):
         self.descriptive = descriptive_data
         self.pairs = xy_pairs
         self.path = filepath
-        self.filename = self.path.split("\\")[-1]
+        self.filename = os.path.basename(self.path)
+        self.meta = meta
 
     def __str__(self):
         return self.path
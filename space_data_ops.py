@@ -35,113 +35,154 @@
 #
 # Includes: import NASA ECOSTRESS Spectral Library files
 # into DataObjects (see DataObject.py), re-index dataframes,
-# find common range, truncate dataframes to common range,
-# align data to be in the same step, and add in missing values 
+# find common range, truncate dataframes to common range and
+# align data to be in the same step, adding in missing values
 # with interpolation, normalization, principal component analysis (PCA)
 # dimensionality reduction, combine dataframes.
 
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from DataObject import DataObject
-from sklearn import preprocessing
 from sklearn.decomposition import PCA
-from scipy.stats import zscore
 
 # columns include overflow for extra ":" characters found in the description field
 columns = ['descriptor', 'value', 'overflow', 'overflow2', 'overflow3']
 
+# matches a line of numerical (x, y) pairs: two fields split by a single tab, with no ":"
+pair_line = re.compile(rb'[^\t:\r\n]*\t[^\t:\r\n]*\r?')
+
+# file lists at least this long are parsed in parallel worker processes
+PARALLEL_PARSE_THRESHOLD = 64
+
+# parsed DataObjects, keyed by (file path, modification time, size), so re-importing unchanged files is free
+PARSE_CACHE_SIZE = 10000
+parse_cache = {}
+
 
 # linked to functional requirement #3 - preprocessing of data files
 def file_to_data_object(file_list):
     """
     Function: File to DataObject
-    Description: This function takes a list of files (files variable above) and converts them to two pandas
-    DataFrames, one of descriptive data, and one of float values for the xy_pairs. The DataFrames are used as
-    parameters to construct a DataObject. The function then returns an array of each file as a DataObject.
-    Returns: DataObjects array
+    Description: This function takes a list of files (files variable above) and converts each of them to a
+    DataObject with parse_file. Files are parsed in parallel worker processes when there are enough of them
+    to be worth starting the workers. Files that are unchanged since they were last parsed are taken from
+    parse_cache instead. The function then returns an array of each file as a DataObject.
+    Returns: DataObjects array, and an error message (empty string on success)
     """
-    DataObjects = []
-    # DataFrame conversion - one DF for descriptive data, and one DF for the (x, y) pairs
+    keys = []
     for item in file_list:
-        data = pd.read_csv(item, sep=":", header=None, engine="python", names=columns, quotechar='"')
-
-        pairs, pair_index, desc_index = [], 0, 0
-        # the first column contains both the pairs and the labels for descriptive data
-        first_col = data['descriptor']
-        # search every row in the first column for \t
-        for value in first_col:
-            # find the index where xy_pairs begin
-            # I noticed that all the pairs contain tabs, so search each file for the first occurrence of \t
-            if "\t" in value and len(value.split("\t")) == 2:
-                for val in value.split("\t"):
-                    try:
-                        float(val)
-                    except ValueError:
-                        return [], f"{item} contains an invalid or missing value at numerical pair: {value}"
-                pairs.append(value.split("\t"))
-                if pair_index == 0:
-                    pair_index = first_col[first_col == value].index[0]
-            # find the index for the description field for description processing below
-            elif "Description" in value:
-                desc_index = first_col[first_col == "Description"].index[0]
-
-        # convert pairs to DataFrame, with column labels for given X Units and Y Units
-        if pair_index != 0:
-            descriptive_data = data.head(pair_index)
-            # find index of "X Units" and "Y Units" to find unit labels
-            x_units = first_col[first_col == "X Units"].index[0]
-            y_units = first_col[first_col == "Y Units"].index[0]
-            xy_pairs = pd.DataFrame(pairs,
-                                    columns=[descriptive_data.loc[x_units, 'value'],
-                                             descriptive_data.loc[y_units, 'value']])
-        # throw an error if the pair_index is zero (means that "\t" was not found in the file)
-        else:
-            descriptive_data = data
-            return [], f"Numerical coordinate pairs could not found for {item}"
-
-        # Description Processing: for DataFrame conversion, overflow columns were needed
-        # for the descriptions of each spectra, the code below removes the overflow.
-
-        # Make a copy, this is recommended by pandas documentation for modifying individual cells
-        descriptive_copy = descriptive_data.copy()
-        # if overflow is nan, drop overflow columns
-        if pd.isna(descriptive_data.loc[desc_index, 'overflow']):
-            descriptive_data = descriptive_data.dropna(axis=1)
-
-        # if overflow2 is nan, combine value and overflow for description, and drop overflow columns
-        elif pd.isna(descriptive_data.loc[desc_index, 'overflow2']):
-            combine_string = ': ' + descriptive_data.loc[desc_index, 'overflow']
-            descriptive_copy.loc[desc_index, 'value'] = descriptive_data.loc[desc_index, 'value'] + combine_string
-            descriptive_data = descriptive_copy.drop(['overflow', 'overflow2', 'overflow3'], axis=1)
-
-        # if overflow3 is nan, combine value and overflow1 and 2 for description, and drop overflow columns
-        elif pd.isna(descriptive_data.loc[desc_index, 'overflow3']):
-            combine_string = ': ' + descriptive_data.loc[desc_index, 'overflow'] + ': ' + \
-                             descriptive_data.loc[desc_index, 'overflow2']
-            descriptive_copy.loc[desc_index, 'value'] = descriptive_data.loc[desc_index, 'value'] + combine_string
-            descriptive_data = descriptive_copy.drop(['overflow', 'overflow2', 'overflow3'], axis=1)
-
-        # else combine all overflow columns with value, and drop overflow columns
-        else:
-            combine_string = ': ' + descriptive_data.loc[desc_index, 'overflow'] + ': ' + \
-                             descriptive_data.loc[desc_index, 'overflow2'] + ': ' + \
-                             descriptive_data.loc[desc_index, 'overflow3']
-            descriptive_copy.loc[desc_index, 'value'] = descriptive_data.loc[desc_index, 'value'] + combine_string
-            descriptive_data = descriptive_copy.drop(['overflow', 'overflow2', 'overflow3'], axis=1)
-
-        # DataFrame values are initially typed as objects, code below is conversion to workable data types
-        # convert descriptive data to strings
-        descriptive_data = descriptive_data.convert_dtypes(convert_string=True)
-        # convert xy_pairs to floats
-        xy_pairs[xy_pairs.columns[0]] = xy_pairs[xy_pairs.columns[0]].astype(float)
-        xy_pairs[xy_pairs.columns[1]] = xy_pairs[xy_pairs.columns[1]].astype(float)
-        # construct DataObject with DataFrames and filepath (may want more parameters later)
-        processed_item = DataObject(descriptive_data, xy_pairs, item)
-        DataObjects.append(processed_item)
-
+        stat = os.stat(item)
+        keys.append((item, stat.st_mtime_ns, stat.st_size))
+    parsed = {key: parse_cache[key] for key in keys if key in parse_cache}
+    missing = [key for key in keys if key not in parsed]
+    missing_files = [key[0] for key in missing]
+    if len(missing_files) < PARALLEL_PARSE_THRESHOLD:
+        results = map(parse_file, missing_files)
+    else:
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(parse_file, missing_files, chunksize=16))
+
+    for key, (processed_item, message) in zip(missing, results):
+        if processed_item is None:
+            return [], message
+        parsed[key] = processed_item
+        if len(parse_cache) >= PARSE_CACHE_SIZE:
+            # drop the oldest file
+            parse_cache.pop(next(iter(parse_cache)))
+        parse_cache[key] = processed_item
+
+    # later steps modify the pairs dataframes, so every import gets its own copy of them
+    DataObjects = [DataObject(parsed[key].descriptive, parsed[key].pairs.copy(), parsed[key].path, parsed[key].meta)
+                   for key in keys]
     return DataObjects, ""
 
 
+# linked to functional requirement #3 - preprocessing of data files
+def parse_file(item):
+    """
+    This function takes a single file and converts it to two pandas DataFrames, one of descriptive data,
+    and one of float values for the xy_pairs. The DataFrames are used as parameters to construct a DataObject.
+    Returns: (DataObject, "") on success, or (None, error message) if the file could not be parsed
+    """
+    # DataFrame conversion - one DF for descriptive data, and one DF for the (x, y) pairs
+    with open(item, 'rb') as f:
+        raw = f.read()
+
+    # find the byte offset where xy_pairs begin
+    # all the pairs are tab-separated, so the first line holding a single tab (and no ":") starts the pairs
+    pair_index = find_pair_start(raw)
+    # throw an error if the pair_index is not positive (means that "\t" was not found in the file,
+    # or there is no descriptive data before the pairs)
+    if pair_index <= 0:
+        return None, f"Numerical coordinate pairs could not found for {item}"
+
+    # everything before the pairs is descriptive data, parsed with the C engine
+    # (read as strings, so numeric overflow such as the "05" of "10:05" is not turned into a float)
+    descriptive_data = pd.read_csv(io.BytesIO(raw[:pair_index]), sep=":", header=None, names=columns,
+                                   quotechar='"', dtype=str)
+    # the first column contains the labels for descriptive data
+    first_col = descriptive_data['descriptor']
+    # map each label to the index of its first occurrence, so lookups don't rescan the column
+    idx_of = {}
+    for i, value in enumerate(first_col.values):
+        idx_of.setdefault(value, i)
+    # find index of "X Units" and "Y Units" to find unit labels
+    x_units = idx_of["X Units"]
+    y_units = idx_of["Y Units"]
+
+    # convert pairs to DataFrame of floats, with column labels for given X Units and Y Units
+    # (float32 is plenty for the 3-4 significant figures of the data, and halves the memory used downstream)
+    try:
+        xy_pairs = pd.read_csv(io.BytesIO(raw[pair_index:]), sep="\t", header=None, dtype=np.float32,
+                               names=[descriptive_data.loc[x_units, 'value'],
+                                      descriptive_data.loc[y_units, 'value']])
+    except ValueError:
+        xy_pairs = None
+    if xy_pairs is None or xy_pairs.isna().values.any():
+        return None, f"{item} contains an invalid or missing value in its numerical pairs"
+
+    # Description Processing: for DataFrame conversion, overflow columns were needed
+    # for the descriptions of each spectra, the code below joins the overflow back onto the value
+    # (with the ": " the split removed).
+    values = descriptive_data[['value', 'overflow', 'overflow2', 'overflow3']].to_numpy()
+    merged = [': '.join(x for x in row if isinstance(x, str)) if isinstance(row[0], str) else row[0]
+              for row in values]
+    # map each label to its (stripped) value once, so later lookups don't rescan descriptive_data
+    meta = {descriptor: merged[i].strip() for descriptor, i in idx_of.items() if isinstance(merged[i], str)}
+
+    # DataFrame values are initially typed as objects, so the final descriptive data is built directly
+    # as strings from the merged values, rather than copying the parsed DataFrame to drop the overflow
+    # columns and copying it again to convert types (xy_pairs are already parsed as floats)
+    descriptive_data = pd.DataFrame({'descriptor': pd.array(first_col.to_numpy(), dtype="string"),
+                                     'value': pd.array(merged, dtype="string")})
+    # construct DataObject with DataFrames, filepath and descriptor lookup
+    return DataObject(descriptive_data, xy_pairs, item, meta), ""
+
+
+# linked to functional requirement #3 - preprocessing of data files
+def find_pair_start(raw):
+    """
+    This function takes the raw bytes of a file and returns the byte offset of the
+    first line of numerical (x, y) pairs, or -1 if there is none.
+    The descriptive data rarely contains tabs, so bytes.find (a C-speed scan) jumps
+    straight to the first tab, and only the line holding it is checked against pair_line.
+    """
+    tab = raw.find(b'\t')
+    while tab != -1:
+        line_start = raw.rfind(b'\n', 0, tab) + 1
+        line_end = raw.find(b'\n', tab)
+        if line_end == -1:
+            line_end = len(raw)
+        if pair_line.fullmatch(raw, line_start, line_end):
+            return line_start
+        tab = raw.find(b'\t', line_end)
+    return -1
+
+
 # linked to functional requirement #6 - data normalization
 def reindex(data_objects):
     """
@@ -152,14 +193,22 @@ def reindex(data_objects):
     the new index. [note also some columns have (micrometer) without
     the plural s]
     The ' Wavelength (micrometers)' column is renamed 'wavelength'.
-    Dataframes are modified in-place, so None is returned.
+    Rows are then put in ascending wavelength order: already ascending
+    dataframes are left alone, descending ones (as the ECOSTRESS files
+    are) are reversed, and anything else is reordered with argsort.
+    Dataframes are modified in-place (or replaced when reordered), so None is returned.
     """
     for dobj in data_objects:
         dataframe = dobj.pairs
         wavelength_col_name = dataframe.columns[0]
         dataframe.rename(columns={wavelength_col_name: 'wavelength'}, inplace=True)
         dataframe.set_index('wavelength', inplace=True)
-        dataframe.sort_index(inplace=True)
+        wavelengths = dataframe.index.values
+        steps = np.diff(wavelengths)
+        if (steps < 0).all():
+            dobj.pairs = dataframe.iloc[::-1]
+        elif not (steps >= 0).all():
+            dobj.pairs = dataframe.iloc[np.argsort(wavelengths, kind='stable')]
     return None
 
 
@@ -172,15 +221,15 @@ def find_common_range(data_objects):
     When done, if min < max, then the common range of all data objects is
     min to max. Return (min, max).
     If min > max, the data objects have no range in common. Return (None, None).
+    The indexes are sorted by reindex, so each minimum and maximum is just
+    the first and last wavelength.
     """
-    highest_minimum = data_objects[0].pairs.index.min()
-    lowest_maximum = data_objects[0].pairs.index.max()
-    for dobj in data_objects[1:]:
-        dataframe = dobj.pairs
-        if dataframe.index.min() > highest_minimum:
-            highest_minimum = dataframe.index.min()
-        if dataframe.index.max() < lowest_maximum:
-            lowest_maximum = dataframe.index.max()
+    minimums = np.fromiter((dobj.pairs.index.values[0] for dobj in data_objects), dtype=np.float32,
+                           count=len(data_objects))
+    maximums = np.fromiter((dobj.pairs.index.values[-1] for dobj in data_objects), dtype=np.float32,
+                           count=len(data_objects))
+    highest_minimum = minimums.max()
+    lowest_maximum = maximums.min()
     if highest_minimum < lowest_maximum:
         return highest_minimum, lowest_maximum
     else:
@@ -188,56 +237,36 @@ def find_common_range(data_objects):
 
 
 # linked to functional requirement #6 - data normalization
-def truncate(data_objects, min, max):
-    """
-    This function takes a list of data objects, iterates over them,
-    and truncates every 'pairs' dataframe to remove any rows (wavelengths)
-    below 'min' and above 'max'. The result is that all 'pairs' dataframes
-    will have the same range of wavelengths. (Note that wavelengths are
-    not aligned here; that comes later.)
-    Pandas can't truncate in place, so a new truncated dataframe is
-    constructed and then the DataObject 'pairs' dataframe is replaced
-    with the new dataframe. Returns None.
-    """
-    for dobj in data_objects:
-        original_dataframe = dobj.pairs
-        truncated_dataframe = original_dataframe.truncate(before=min, after=max, axis='index', copy=True)
-        dobj.pairs = truncated_dataframe
-    return None
-
-
-# linked to functional requirement #6 - data normalization
-def find_max_res(data_objects):
-    """
-    This function takes a list of data objects, iterates over them,
-    and finds the data object with the most data points.
-    It returns the index of this object.
+def truncate_align_interpolate(data_objects, min, max):
     """
-    max_pts = 0
-    max_pts_index = 0
-    for i in range(len(data_objects)):
-        cur_pts = data_objects[i].pairs.size
-        if cur_pts > max_pts:
-            max_pts = cur_pts
-            max_pts_index = i
-    return max_pts_index
-
-
-# linked to functional requirement #6 - data normalization
-def align(data_objects, align_to):
-    """
-    This function takes a list of data objects, iterates over them,
-    and makes every 'pairs' dataframe use the same x axis by aligning
-    them to the data object at the index specified by align_to.
-    The result is that all 'pairs' dataframes will use the same x
-    axis and thus be aligned.  This will then fill in any missing
-    values caused by the alignment using linear interpolation.
+    This function takes a list of data objects and the common range
+    'min' to 'max', and makes every 'pairs' dataframe use the same x axis
+    in a single reindex per data object.
+    Every 'pairs' dataframe is truncated to the range (a slice of the
+    sorted index, not a copy). The x axis is that of the data object with
+    the most data points in the range (the highest resolution). Each
+    dataframe is reindexed onto the union of its own wavelengths and that
+    x axis, missing values are filled in using linear interpolation, and
+    the result is reindexed to the x axis alone. Only the first data
+    point of a repeated wavelength is kept.
+    The result is that all 'pairs' dataframes will have the same range
+    of wavelengths, use the same x axis, and thus be aligned.
+    The DataObject 'pairs' dataframes are replaced. Returns None.
     """
-    alignment_pairs = data_objects[align_to].pairs
-    for dobj in data_objects:
-        (_, dobj.pairs) = alignment_pairs.align(dobj.pairs, join="outer", axis=0)
-        dobj.pairs = dobj.pairs.interpolate(limit_direction='both')
-        (_, dobj.pairs) = alignment_pairs.align(dobj.pairs, join="left", axis=0)
+    # [start, stop) positions of the common range in each sorted index
+    bounds = [(dobj.pairs.index.searchsorted(min, side='left'), dobj.pairs.index.searchsorted(max, side='right'))
+              for dobj in data_objects]
+    # the x axis comes from the file with the highest resolution in the common range
+    align_to = int(np.argmax([stop - start for start, stop in bounds]))
+    start, stop = bounds[align_to]
+    target_index = data_objects[align_to].pairs.index[start:stop]
+    # a repeated wavelength can't be reindexed on, so only its first data point is kept
+    target_index = target_index[~target_index.duplicated()]
+    for dobj, (start, stop) in zip(data_objects, bounds):
+        truncated = dobj.pairs.iloc[start:stop]
+        truncated = truncated[~truncated.index.duplicated()]
+        merged = truncated.reindex(truncated.index.union(target_index)).interpolate(limit_direction='both')
+        dobj.pairs = merged.reindex(target_index)
     return None
 
 
@@ -250,11 +279,37 @@ def combine(data_objects):
     This block will have each data_object taking up one row where
     each column is a different y coordinate.
     Returns a block of data.
+    The y coordinates are copied into one contiguous array, which is then
+    wrapped in a dataframe with the wavelengths as column labels.
     """
-    data_block = pd.concat([dobj.pairs.transpose() for dobj in data_objects], ignore_index=True)
+    data_block = pd.DataFrame(stack_pairs(data_objects), columns=data_objects[0].pairs.index)
     return data_block
 
 
+def stack_pairs(data_objects):
+    """
+    This function takes a list of data objects all sharing a common
+    x axis (i.e., they are already aligned) and copies their y
+    coordinates into one contiguous float32 array of shape objects x wavelengths.
+    Returns the array.
+    """
+    block = np.empty((len(data_objects), data_objects[0].pairs.shape[0]), dtype=np.float32)
+    for i, dobj in enumerate(data_objects):
+        block[i, :] = dobj.pairs.values[:, 0]
+    return block
+
+
+def unstack_pairs(data_objects, block):
+    """
+    This function is the reverse of stack_pairs. It replaces the 'pairs'
+    dataframe of every data object with a dataframe viewing the matching
+    row of the block (no copy is made). Returns None.
+    """
+    for i, dobj in enumerate(data_objects):
+        dobj.pairs = pd.DataFrame(block[i:i + 1].T, index=dobj.pairs.index, columns=dobj.pairs.columns, copy=False)
+    return None
+
+
 # linked to functional requirement #6 - data normalization
 # linked to functional requirement #7 - PCA
 def pca(dataObjectArray, dimensions):
@@ -263,33 +318,33 @@ def pca(dataObjectArray, dimensions):
     and a number of dimensions and performs PCA dimensionality
     reduction to the specified number of dimensions.
     Returns the data block transformed to n-dimensions.
-    A bug arose during testing that we believe to be Windows build-related (np.linalg.LinAlgError).
-    As far as we have tested, the bug does not affect the results of PCA or of any other process.
-    We also could not find an actual solution (or source) after several hours of debugging with two team members,
-    so, in the interest of time, we have added a while-try-except statement to PCA to ignore this bug/warning.
+    The number of dimensions is small compared to the number of wavelengths,
+    so the randomized SVD solver is used.
+    This also avoids the full-SVD np.linalg.LinAlgError we saw in testing on
+    Windows builds, which used to be ignored with a while-try-except statement.
+    PCA centers its input in place, so it is given an explicit contiguous float32
+    copy of the block and the caller's dataframe is never modified.
     """
-    while True:
-        try:
-            pca = PCA(n_components=dimensions, copy=False, svd_solver='full')
-            pca.fit(dataObjectArray)
-            transformed = pca.transform(dataObjectArray)
-            return pd.DataFrame(transformed, index=dataObjectArray.index)
-        except np.linalg.LinAlgError:
-            continue
+    pca = PCA(n_components=dimensions, copy=False, svd_solver='randomized', random_state=0)
+    block = np.array(dataObjectArray.values, dtype=np.float32, order='C', copy=True)
+    return pd.DataFrame(pca.fit_transform(block), index=dataObjectArray.index)
 
 
 def linear_normalize(data_objects):
     """
     This function takes a list of data objects
     and normalizes data from range 0 to 1.
+    The data objects must already be aligned; every spectrum is
+    rescaled at once as one row of a stacked block.
     Returns the normalized data objects
     """
-    scaler = preprocessing.MinMaxScaler()
-    for i in data_objects:
-        normalized_pairs = scaler.fit_transform(i.pairs)
-        n = i.pairs.columns[0]
-        i.pairs.drop(n, axis=1, inplace=True)
-        i.pairs[n] = normalized_pairs
+    block = stack_pairs(data_objects)
+    block -= block.min(axis=1, keepdims=True)
+    span = block.max(axis=1, keepdims=True)
+    # a flat spectrum becomes all zeros rather than dividing by zero
+    span[span == 0] = 1
+    block /= span
+    unstack_pairs(data_objects, block)
     return data_objects
 
 
@@ -304,10 +359,14 @@ def zScore_normalize(data_objects):
     This function takes a list of data objects
     and rescales data based on how many standard deviations
     the point is away from the mean of the dataset.
+    The data objects must already be aligned; every spectrum is
+    rescaled at once as one row of a stacked block.
     Returns the modified data objects
     """
-    for df in data_objects:
-        df.pairs = df.pairs.apply(zscore)
+    block = stack_pairs(data_objects)
+    block -= block.mean(axis=1, keepdims=True)
+    block /= block.std(axis=1, keepdims=True)
+    unstack_pairs(data_objects, block)
     return data_objects
 
 
@@ -69,21 +69,13 @@ def db_comp(db, data_objects, sort_category):
     Composition dataframe is of shape clusters x categories.
     Each row is a cluster, and each column is a category.
     """
-    labels = list(map(lambda x: x + 1, db.labels_))
-    comp = pd.DataFrame(index=range(len(set(labels))))
+    # shift labels by +1 so noise (-1) becomes cluster 0
+    labels = db.labels_ + 1
+    categories = [dobj.meta[sort_category].upper() if sort_category in dobj.meta else "None specified"
+                  for dobj in data_objects]
+    comp = pd.crosstab(labels, np.array(categories), rownames=["Cluster No."], colnames=[None])
+    comp = comp.reindex(range(labels.max() + 1), fill_value=0)
     comp.index.name = "Cluster No."
-    for i in range(len(data_objects)):
-        if sort_category in data_objects[i].descriptive.descriptor.values:
-            category = data_objects[i].descriptive. \
-                loc[data_objects[i].descriptive['descriptor'] == sort_category, 'value'].iloc(0)[0].upper()
-        else:
-            category = "None specified"
-        if not (category in comp.columns):
-            comp.insert(0, category, 0)
-            comp.at[labels[i], category] = 1
-        else:
-            comp.at[labels[i], category] += 1
-
     return comp
 
 
@@ -34,12 +34,36 @@
 # This file contains functions that interact with files and folders.
 #
 # Includes: check if a path is valid, selecting files in
-# a folder and subfolders, filtering files by filename, save modified
-# data files as .csv, save data blocks as .csv, save cluster
-# compositions as .csv
+# a folder and subfolders, filtering files by filename, cache aligned
+# data objects, save modified data files as .csv, save data blocks
+# as .csv, save cluster compositions as .csv
 
-import os.path
-import glob
+import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from DataObject import DataObject
+
+# input filenames must contain 'tir' 'nicolet' and 'spectrum' (in any order)
+input_filename = re.compile(r'(?=.*tir)(?=.*nicolet)(?=.*spectrum)', re.DOTALL)
+
+# aligned data is cached in this per-user folder, never in the input folder,
+# one file per input_files_key
+ALIGNED_CACHE_FOLDER = os.path.join(os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+                                    or os.path.join(os.path.expanduser("~"), ".cache"), "SpACE")
+# number of most recently used caches kept, older ones are deleted
+ALIGNED_CACHE_KEEP = 8
+# change this whenever the cache layout or the parsing/alignment results change, to ignore old caches
+ALIGNED_CACHE_VERSION = "2"
+
+# number of files save_data_files writes at once
+SAVE_THREADS = 8
+
+# spectra are float32, so values are saved to float32 precision (7 significant digits)
+# instead of printing the noise digits of the shortest float32 repr
+CSV_FLOAT_FORMAT = "%.7g"
 
 
 # linked to functional requirement #5 - accepting input from files
@@ -51,32 +75,210 @@ def path_exists(folder):
     return os.path.exists(folder)
 
 
+# linked to functional requirement #4 - filtering input from files
 # linked to functional requirement #5 - accepting input from files
 # linked to functional requirement #10 - accept subset of data files in folders
 # linked to non-functional requirement #3 - accept up to 2000 files
-def collect_all_filenames(folder):
+def collect_input_files(folder):
     """
     Finds all files in a given folder and all of its
-    subfolders. Returns a Python list where each entry
-    is a filename with full path to the file.
+    subfolders, retaining only those that have 'tir'
+    'nicolet' 'spectrum' in the filename and end in '.txt'.
+    Hidden files and folders (starting with '.') are skipped.
+    Returns a Python list where each entry is a
+    filename with full path to the file.
     """
-    return glob.glob(folder + '/**', recursive=True)
+    return list(iter_input_files(folder))
 
 
-# linked to functional requirement #4 - filtering input from files
-# linked to functional requirement #5 - accepting input from files
-# linked to non-functional requirement #3 - accept up to 2000 files
-def filter_filenames(file_list):
+def iter_input_files(folder):
+    """
+    Generator behind collect_input_files. Walks the folder tree
+    with os.scandir, which gets each entry's name and type from
+    the directory listing, so no separate stat is needed to skip
+    folders and non-.txt files.
+    """
+    folders = [folder]
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.endswith('.txt') and input_filename.match(entry.name):
+                    yield entry.path
+
+
+def input_files_key(file_list):
+    """
+    Returns a hash of the paths, modification times and sizes
+    of a list of files. The hash changes whenever a file is
+    added, removed or modified.
+    """
+    digest = hashlib.sha256(ALIGNED_CACHE_VERSION.encode())
+    for filename in sorted(file_list):
+        stat = os.stat(filename)
+        # os.fsencode gives back the original bytes of file names that are not valid UTF-8
+        digest.update(os.fsencode(filename) + ("|%s|%s\n" % (stat.st_mtime_ns, stat.st_size)).encode())
+    return digest.hexdigest()
+
+
+def pack_strings(strings):
     """
-    Iterates through a list of files and retains only
-    those that have 'tir' 'nicolet' 'spectrum' and '.txt'
-    in the filename. Returns a Python list.
+    Accepts a list of strings. Returns their UTF-8 bytes joined into
+    one uint8 array, and the end offset of each string in it.
     """
-    return list(filter(lambda filename: 'tir' in filename
-                                        and 'nicolet' in filename
-                                        and 'spectrum' in filename
-                                        and '.txt' in filename,
-                       file_list))
+    # surrogateescape round trips file names that are not valid UTF-8
+    encoded = [str(string).encode("utf-8", "surrogateescape") for string in strings]
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    ends = np.cumsum([len(string) for string in encoded], dtype=np.int64)
+    return data, ends
+
+
+def unpack_strings(data, ends):
+    """
+    Accepts the bytes and end offsets made by pack_strings.
+    Returns the list of strings.
+    """
+    joined = data.tobytes()
+    starts = np.concatenate(([0], ends[:-1])).tolist()
+    return [joined[start:end].decode("utf-8", "surrogateescape") for start, end in zip(starts, ends.tolist())]
+
+
+# linked to functional requirement #3 - preprocessing of data files
+def save_aligned_cache(cache_folder, file_list, data_objects):
+    """
+    Accepts the cache folder, the list of input files, and the
+    aligned data objects made from them. Saves the aligned y values
+    as one block, the shared wavelengths, and each object's path,
+    descriptive data and meta into a single compressed .npz file in
+    the cache folder, named and keyed by input_files_key of the file list.
+    Only the ALIGNED_CACHE_KEEP most recently used caches are kept.
+    Returns True if the cache was saved, False if it could not be.
+    """
+    cache_path = None
+    try:
+        arrays = aligned_cache_arrays(file_list, data_objects)
+        os.makedirs(cache_folder, exist_ok=True)
+        cache_path = os.path.join(cache_folder, str(arrays["key"]) + ".npz")
+        # write to a temporary file first, so an interrupted save never leaves a broken cache
+        with open(cache_path + ".tmp", "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(cache_path + ".tmp", cache_path)
+    except Exception:
+        # the cache is only a speed up, failing to write it must never stop the import
+        if cache_path is not None:
+            try:
+                os.remove(cache_path + ".tmp")
+            except OSError:
+                pass
+        return False
+    prune_aligned_caches(cache_folder)
+    return True
+
+
+def prune_aligned_caches(cache_folder):
+    """
+    Deletes all but the ALIGNED_CACHE_KEEP most recently used
+    caches in the cache folder. Returns None.
+    """
+    try:
+        caches = [entry for entry in os.scandir(cache_folder) if entry.is_file() and entry.name.endswith(".npz")]
+        caches.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        for entry in caches[ALIGNED_CACHE_KEEP:]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+    return None
+
+
+def aligned_cache_arrays(file_list, data_objects):
+    """
+    Accepts the list of input files and the aligned data objects made
+    from them. Returns the dict of arrays saved in an aligned cache.
+    """
+    descriptive = [dobj.descriptive for dobj in data_objects]
+    values = pd.concat([df['value'] for df in descriptive], ignore_index=True)
+    strings = {
+        "paths": [dobj.path for dobj in data_objects],
+        "y_units": [dobj.pairs.columns[0] for dobj in data_objects],
+        "descriptors": pd.concat([df['descriptor'] for df in descriptive]).tolist(),
+        "values": values.fillna("").tolist(),
+        "meta_keys": [key for dobj in data_objects for key in dobj.meta],
+        "meta_values": [value for dobj in data_objects for value in dobj.meta.values()],
+    }
+    arrays = {
+        "key": np.array(input_files_key(file_list)),
+        "block": np.vstack([dobj.pairs.values[:, 0] for dobj in data_objects]),
+        "wavelengths": data_objects[0].pairs.index.values,
+        "header_lengths": np.array([len(df) for df in descriptive]),
+        "values_missing": values.isna().to_numpy(),
+        "meta_lengths": np.array([len(dobj.meta) for dobj in data_objects]),
+    }
+    # strings are stored as joined UTF-8 bytes with offsets, fixed width string
+    # arrays would pad every entry to the longest one
+    for name, column in strings.items():
+        arrays[name], arrays[name + "_ends"] = pack_strings(column)
+    return arrays
+
+
+# linked to functional requirement #3 - preprocessing of data files
+def load_aligned_cache(cache_folder, file_list):
+    """
+    Accepts the cache folder and the list of input files. If the folder
+    holds an aligned cache (see save_aligned_cache) saved for exactly
+    these files, unchanged since, returns the aligned data objects
+    rebuilt from it. Otherwise returns an empty list.
+    """
+    try:
+        key = input_files_key(file_list)
+        cache_path = os.path.join(cache_folder, key + ".npz")
+        if not path_exists(cache_path):
+            return []
+        # allow_pickle=False: the cache only holds plain arrays, so loading it can never run code
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if str(cache["key"]) != key:
+                return []
+            arrays = {name: cache[name] for name in cache.files}
+        data_objects = cached_data_objects(arrays)
+        # mark the cache as recently used, so prune_aligned_caches keeps it
+        os.utime(cache_path)
+        return data_objects
+    except Exception:
+        # a damaged or unreadable cache (truncated zip, bad zip data, missing or inconsistent arrays)
+        # is just a cache miss, the files are parsed again and the cache rewritten
+        return []
+
+
+def cached_data_objects(arrays):
+    """
+    Rebuilds the aligned data objects from the arrays of an aligned cache.
+    Returns a list of data objects.
+    """
+    for name in ("paths", "y_units", "descriptors", "values", "meta_keys", "meta_values"):
+        arrays[name] = np.array(unpack_strings(arrays[name], arrays[name + "_ends"]), dtype=object)
+    wavelengths = pd.Index(arrays["wavelengths"], name="wavelength")
+    header_ends = np.cumsum(arrays["header_lengths"])
+    meta_ends = np.cumsum(arrays["meta_lengths"])
+    y_units = arrays["y_units"].tolist()
+    data_objects = []
+    for i, path in enumerate(arrays["paths"].tolist()):
+        header = slice(header_ends[i] - arrays["header_lengths"][i], header_ends[i])
+        values = [None if missing else value for value, missing in
+                  zip(arrays["values"][header].tolist(), arrays["values_missing"][header])]
+        descriptive_data = pd.DataFrame({'descriptor': pd.array(arrays["descriptors"][header], dtype="string"),
+                                         'value': pd.array(values, dtype="string")})
+        meta_range = slice(meta_ends[i] - arrays["meta_lengths"][i], meta_ends[i])
+        meta = dict(zip(arrays["meta_keys"][meta_range].tolist(), arrays["meta_values"][meta_range].tolist()))
+        # each pairs dataframe views its row of the block, as after normalization (see space_data_ops.unstack_pairs)
+        xy_pairs = pd.DataFrame(arrays["block"][i:i + 1].T, index=wavelengths, columns=[y_units[i]], copy=False)
+        data_objects.append(DataObject(descriptive_data, xy_pairs, path, meta))
+    return data_objects
 
 
 # linked to functional requirement #8 - saving data after modifications
@@ -88,15 +290,21 @@ def save_data_files(folder, suffix, data_objects):
     Accepts a specified filepath, a suffix to add to it,
     and a list of data_objects. Iterates through them all
     and saves them to the filepath with the suffix added on.
-    Saves as .csv
+    Saves as .csv, several files at a time on a small thread pool
+    so that formatting one file overlaps with writing another.
     """
     dir_name = os.path.join(folder, suffix)
     if not path_exists(dir_name):
         os.mkdir(dir_name)
-    for dobj in data_objects:
+
+    def save_data_file(dobj):
         file_name = dobj.filename.rstrip("txt") + "csv"
         save_string = os.path.join(dir_name, file_name)
-        dobj.pairs.to_csv(save_string)  # other arguments can be supplied, check pandas docs
+        dobj.pairs.to_csv(save_string, float_format=CSV_FLOAT_FORMAT)  # other arguments can be supplied, check pandas docs
+
+    with ThreadPoolExecutor(max_workers=SAVE_THREADS) as executor:
+        # list() waits for every file and re-raises any error from the threads
+        list(executor.map(save_data_file, data_objects))
 
 
 # linked to functional requirement #8 - saving data after modifications
@@ -120,7 +328,7 @@ def save_block_data(folder, suffix, dataset):
     if not path_exists(dir_name):
         os.mkdir(dir_name)
     save_string = os.path.join(dir_name, "data_block.csv")
-    dataset.to_csv(save_string)  # other arguments can be supplied, check pandas docs
+    dataset.to_csv(save_string, float_format=CSV_FLOAT_FORMAT)  # other arguments can be supplied, check pandas docs
 
 
 # linked to functional requirement #8 - saving data after modifications
@@ -313,50 +313,26 @@ class SpaceApp(tk.Frame):
         self._data_objs = []
         self._dataset = None
         self.log("-- Begin data import and pre-processing --")
-        # search for all files in input folder and subfolder
-        file_list = fileops.collect_all_filenames(self._Var_folder.get())
-        self.log("Found %s files and folders in %s" % (len(file_list), self._Var_folder.get()))
-        # filter by filename
-        filtered_file_list = fileops.filter_filenames(file_list)
-        self.log("Found %s files matching the filename filter criteria" % len(filtered_file_list))
+        # search for all files in input folder and subfolder, filtered by filename
+        filtered_file_list = fileops.collect_input_files(self._Var_folder.get())
+        self.log("Found %s files matching the filename filter criteria in %s"
+                 % (len(filtered_file_list), self._Var_folder.get()))
         if len(filtered_file_list) == 0:
             # a empty path is a fatal error
             # log to console and pop up a messagebox
             self.log("No files found path: %s" % self._Var_folder.get())
             self._quick_message_box("No files found:\n%s" % self._Var_folder.get())
             return
-        # parse
-        self.log("Loading into data objects...")
-        self._data_objs, return_msg = dataops.file_to_data_object(filtered_file_list)
-        if not self._data_objs:
-            self.log(return_msg)
-            self._quick_message_box(return_msg)
-            return
-        self.log("Loaded %s data objects" % len(self._data_objs))
-        # re-index the pairs dataframes
-        self.log("Re-indexing pairs dataframes...")
-        dataops.reindex(self._data_objs)
-        # range check
-        self.log("Calculating common range...")
-        min, max = dataops.find_common_range(self._data_objs)
-        if (min, max) == (None, None):
-            # lack of a common range across files is a fatal error
-            # log to console and pop up a messagebox
-            self.log("No range in common!")
-            self._quick_message_box("No range in common!")
-            self._data_objs = []
+        # aligned data objects are cached per user (never in the input folder),
+        # so unchanged input skips straight to normalization
+        self._data_objs = []
+        if self.app_config["CACHE_ALIGNED_DATA"]:
+            self._data_objs = fileops.load_aligned_cache(fileops.ALIGNED_CACHE_FOLDER, filtered_file_list)
+        if self._data_objs:
+            self.log("Loaded %s aligned data objects from the cache, skipping parsing and alignment"
+                     % len(self._data_objs))
+        elif not self._do_parse_and_align(filtered_file_list):
             return
-        else:
-            self.log("All files have this wavelength range in common: %s to %s" % (min, max))
-        # truncate to common range
-        self.log("Truncating data to range %s to %s..." % (min, max))
-        dataops.truncate(self._data_objs, min, max)
-        # finds the index of the file with the highest resolution
-        self.log("Finding highest resolution file...")
-        max_res_index = dataops.find_max_res(self._data_objs)
-        # align the pairs dataframes to dataframe with highest resolution
-        self.log("Aligning the data...")
-        dataops.align(self._data_objs, max_res_index)
         if self._Var_save_after_modify.get():
             self.log("Saving aligned data...")
             fileops.save_data_files(self._Var_folder.get(), "aligned", self._data_objs)
@@ -386,6 +362,42 @@ class SpaceApp(tk.Frame):
 
         self.log("-- End data import and pre-processing --")
 
+    # linked to functional requirement #6 - normalize data
+    # linked to functional requirement #3 - preprocess data files
+    def _do_parse_and_align(self, file_list):
+        """Parse the input files into data objects, then re-index, truncate and align them.
+        Returns False (after logging the error) if the files cannot be used."""
+        # parse
+        self.log("Loading into data objects...")
+        self._data_objs, return_msg = dataops.file_to_data_object(file_list)
+        if not self._data_objs:
+            self.log(return_msg)
+            self._quick_message_box(return_msg)
+            return False
+        self.log("Loaded %s data objects" % len(self._data_objs))
+        # re-index the pairs dataframes
+        self.log("Re-indexing pairs dataframes...")
+        dataops.reindex(self._data_objs)
+        # range check
+        self.log("Calculating common range...")
+        min, max = dataops.find_common_range(self._data_objs)
+        if (min, max) == (None, None):
+            # lack of a common range across files is a fatal error
+            # log to console and pop up a messagebox
+            self.log("No range in common!")
+            self._quick_message_box("No range in common!")
+            self._data_objs = []
+            return False
+        else:
+            self.log("All files have this wavelength range in common: %s to %s" % (min, max))
+        # truncate to common range and align the pairs dataframes to the dataframe with highest resolution
+        self.log("Truncating data to range %s to %s and aligning the data..." % (min, max))
+        dataops.truncate_align_interpolate(self._data_objs, min, max)
+        if self.app_config["CACHE_ALIGNED_DATA"]:
+            if not fileops.save_aligned_cache(fileops.ALIGNED_CACHE_FOLDER, file_list, self._data_objs):
+                self.log("Could not save the aligned data cache in %s" % fileops.ALIGNED_CACHE_FOLDER)
+        return True
+
     # linked to functional requirement #1 - kmeans clustering algorithm
     def _do_kmeans_clustering(self):
         self.log("-- Begin K-means clustering --")
@@ -509,8 +521,13 @@ class SpaceApp(tk.Frame):
         else:
             self.log("PCA reducing data to %s dimensions..." % dimensions)
             plot_dataset = dataops.pca(self._dataset, dimensions)
+        if plot_dataset is self._dataset:
+            plot_clusters = self._k_clusters
+        else:
+            # fit to reduced data for centroids (cached, so switching between 2D and 3D does not refit)
+            plot_clusters = km.do_Kmeans(self._k_clusters.n_clusters, plot_dataset)
         self.log("Plotting...")
-        canvas = plot(plot_dataset, self._k_clusters, embedded=True,
+        canvas = plot(plot_dataset, plot_clusters, embedded=True,
                       master=self._kmeans_viz_panel.get_canvas_frame_handle())
         self._kmeans_viz_panel.display_plot(canvas)
         self.log("-- End K-means plotting --")
@@ -34,14 +34,27 @@
 # This file contains function related to the KMeans algorithm.
 #
 # Includes: K-means clustering, calculate cluster
-# composition, 2D plotting, 3D plotting.
+# composition, sampling large datasets for plotting, 2D plotting, 3D plotting.
 
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+# fitted kmeans objects, keyed by (number of clusters, dataset shape, hash of dataset values),
+# so that re-plotting the same (PCA-reduced) data does not run K-means again
+KMEANS_CACHE_SIZE = 16
+kmeans_cache = {}
+
+# datasets with more samples than this are clustered with MiniBatchKMeans
+MINIBATCH_THRESHOLD = 2000
+
+# plots of datasets with more samples than this draw a random sample of each cluster instead
+PLOT_SAMPLE_THRESHOLD = 20000
+PLOT_SAMPLES_PER_CLUSTER = 2000
+
 
 # linked to functional requirement #1 - kmeans clustering algorithm
 def do_Kmeans(num_clusters, dataset):
@@ -51,8 +64,32 @@ def do_Kmeans(num_clusters, dataset):
     It fits the dataset, and returns a kmeans object which has
     attributes that describe the cluster centroids,
     and which cluster each sample is in.
+    Fits are cached, so the same number of clusters and dataset
+    returns the earlier kmeans object instead of fitting again.
+    Large datasets use MiniBatchKMeans, others use Elkan's algorithm.
+    If the same dataset was just clustered with one cluster fewer, that
+    fit's centroids (plus the point farthest from them) seed a single run.
     """
-    kmeans = KMeans(n_clusters=num_clusters).fit(dataset)
+    values = np.ascontiguousarray(dataset.values)
+    data_key = (values.shape, hash(values.tobytes()))
+    kmeans = kmeans_cache.get((num_clusters,) + data_key)
+    if kmeans is None:
+        previous = kmeans_cache.get((num_clusters - 1,) + data_key)
+        if previous is not None:
+            # warm start: add the point farthest from its nearest centroid as the new centroid
+            farthest = previous.transform(values).min(axis=1).argmax()
+            init, n_init = np.vstack([previous.cluster_centers_, values[farthest]]), 1
+        else:
+            init, n_init = "k-means++", 3
+        if len(values) > MINIBATCH_THRESHOLD:
+            kmeans = MiniBatchKMeans(n_clusters=num_clusters, init=init, n_init=n_init, batch_size=1024)
+        else:
+            kmeans = KMeans(n_clusters=num_clusters, init=init, n_init=n_init, algorithm="elkan")
+        kmeans = kmeans.fit(values)
+        if len(kmeans_cache) >= KMEANS_CACHE_SIZE:
+            # drop the oldest fit
+            kmeans_cache.pop(next(iter(kmeans_cache)))
+        kmeans_cache[(num_clusters,) + data_key] = kmeans
     return kmeans
 
 
@@ -67,30 +104,40 @@ def calculate_composition(km, num_clusters, data_objects, sort_category):
     Composition dataframe is of shape clusters x categories.
     Each row is a cluster, and each column is a category.
     """
-    comp = pd.DataFrame(index=range(num_clusters))
+    categories = [dobj.meta[sort_category].upper() if sort_category in dobj.meta else "None specified"
+                  for dobj in data_objects]
+    comp = pd.crosstab(km.labels_, np.array(categories), rownames=["Cluster No."], colnames=[None])
+    comp = comp.reindex(range(num_clusters), fill_value=0)
     comp.index.name = "Cluster No."
-    for i in range(len(data_objects)):
-        # access the value where descriptor == sort_category
-        if sort_category in data_objects[i].descriptive.descriptor.values:
-            category = data_objects[i].descriptive. \
-                loc[data_objects[i].descriptive['descriptor'] == sort_category, 'value'].iloc(0)[0].upper()
-        else:
-            category = "None specified"
-        if not (category in comp.columns):
-            comp.insert(0, category, 0)
-            comp.at[km.labels_[i], category] = 1
-        else:
-            comp.at[km.labels_[i], category] += 1
-
     return comp
 
 
+# linked to non-functional requirement #2 - perform visualization in under 5 minutes
+def plot_sample(labels, n_clusters):
+    """
+    This function accepts the cluster label of every sample and the number
+    of clusters, and returns the indices of the samples to plot.
+    Small datasets plot every sample. Larger ones plot a random sample of
+    at most PLOT_SAMPLES_PER_CLUSTER points from each cluster, so every
+    cluster still appears and drawing time does not grow with the dataset.
+    """
+    if len(labels) <= PLOT_SAMPLE_THRESHOLD:
+        return np.arange(len(labels))
+    rng = np.random.default_rng(0)  # seeded so redrawing the same plot shows the same points
+    samples = []
+    for cluster in range(n_clusters):
+        members = np.flatnonzero(labels == cluster)
+        samples.append(rng.choice(members, min(PLOT_SAMPLES_PER_CLUSTER, len(members)), replace=False))
+    return np.sort(np.concatenate(samples))
+
+
 # linked to functional requirement #11 - visualize clustered data
 # linked to non-functional requirement #2 - perform visualization in under 5 minutes
 # linked to non-functional requirement #6 - support up to 100 different colors for visualization
 def plot2D(dataset, km, embedded=False, master=None):
     """
-    This function takes a combined pandas dataframe and a kmeans object.
+    This function takes a combined pandas dataframe and a kmeans object
+    fit to that dataframe (see do_Kmeans, which caches fits).
     It plots the K-means clusters and centroids in 2D.
     If embedded is False, the the plot is displayed in a standalone
     modal window, master is ignored, and the function returns None.
@@ -108,11 +155,12 @@ def plot2D(dataset, km, embedded=False, master=None):
 
     cx = []
     cy = []
-    km = km.fit(dataset)  # refit to reduced data for centroids
     for i in km.cluster_centers_:
         cx.append(i[0])
         cy.append(i[1])
-    scatter = axes.scatter(x=dataset[0], y=dataset[1], c=km.labels_, cmap="viridis")
+    sample = plot_sample(km.labels_, km.n_clusters)
+    scatter = axes.scatter(x=dataset[0].values[sample], y=dataset[1].values[sample], c=km.labels_[sample],
+                           cmap="viridis")
     axes.scatter(x=cx, y=cy, marker="x", color="black", s=50)
 
     handles, labels = scatter.legend_elements(num=(km.n_clusters if km.n_clusters % 2 == 0 else
@@ -135,7 +183,8 @@ def plot2D(dataset, km, embedded=False, master=None):
 # linked to non-functional requirement #6 - support up to 100 different colors for visualization
 def plot3D(dataset, km, embedded=False, master=None):
     """
-    This function takes a combined pandas dataframe and a kmeans object.
+    This function takes a combined pandas dataframe and a kmeans object
+    fit to that dataframe (see do_Kmeans, which caches fits).
     It plots the K-means clusters and centroids in 3D.
     If embedded is False, the the plot is displayed in a standalone
     modal window, master is ignored, and the function returns None.
@@ -154,12 +203,13 @@ def plot3D(dataset, km, embedded=False, master=None):
     cx = []
     cy = []
     cz = []
-    km = km.fit(dataset)  # refit to reduced data for centroids
     for i in km.cluster_centers_:
         cx.append(i[0])
         cy.append(i[1])
         cz.append(i[2])
-    scatter = axes.scatter3D(xs=dataset[0], ys=dataset[1], zs=dataset[2], c=km.labels_, cmap="viridis")
+    sample = plot_sample(km.labels_, km.n_clusters)
+    scatter = axes.scatter3D(xs=dataset[0].values[sample], ys=dataset[1].values[sample],
+                             zs=dataset[2].values[sample], c=km.labels_[sample], cmap="viridis")
     axes.scatter3D(xs=cx, ys=cy, zs=cz, marker="x", color="black", s=50)
 
     handles, labels = scatter.legend_elements(num=(km.n_clusters if km.n_clusters % 2 == 0 else
@@ -46,6 +46,7 @@ CONFIG = {
     "PCA_BY_DEFAULT": True,
     "DEFAULT_PCA_DIMENSIONS": 8,
     "SAVE_AFTER_DATA_MODIFICATION_BY_DEFAULT": False,
+    "CACHE_ALIGNED_DATA": True,
     "DEFAULT_KMEANS_K": 8,
     "DEFAULT_DBSCAN_EPS": 1.0,
     "DEFAULT_DBSCAN_MINPTS": 3,